@@ -10,10 +10,22 @@ import sys
 import logging
 from datetime import datetime, timezone, timedelta
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from difflib import SequenceMatcher
+from typing import NamedTuple
 
+import numpy as np
+from datasketch import MinHash, MinHashLSH
 from supabase import create_client, Client
 
+from report_source import LOOKBACK_DAYS, fetch_reports
+
+try:
+    from rapidfuzz import fuzz
+except ImportError:  # native scorer unavailable — fall back to difflib
+    fuzz = None
+
 # ── Configuration ────────────────────────────────────────────────────
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
@@ -21,6 +33,24 @@ SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
 FLOOD_WINDOW_MINUTES = 10
 MIN_DESCRIPTION_LENGTH = 5
 SIMILARITY_THRESHOLD = 0.85
+SHINGLE_SIZE = 5
+MINHASH_PERMUTATIONS = 128
+# MinHash/LSH only pays off on large batches, and it costs recall: a pair
+# can clear SIMILARITY_THRESHOLD while its shingle Jaccard sits below
+# LSH_THRESHOLD (ratio 0.86-0.92 at Jaccard 0.26-0.33 has been observed),
+# so roughly 10% of true duplicates are missed once LSH is in play. Below
+# LSH_MIN_ITEMS every length-compatible pair is scored instead.
+LSH_THRESHOLD = 0.3
+LSH_MIN_ITEMS = 2000
+PARALLEL_MIN_PAIRS = 5000  # difflib fallback only; below this, process start-up costs more
+# ids per .in_() request. Each uuid costs ~39 bytes of URL once its comma
+# is percent-encoded, so 150 keeps the query near 6 KB — under the 8 KB
+# default of nginx/Kong in front of PostgREST.
+BATCH_SIZE = 150
+# Numba import plus compile costs ~1 s on a fresh runner (its cache does not
+# survive between CI runs); is_repetitive takes ~10 µs per description, so
+# the JIT only wins on batches of about this many texts.
+JIT_MIN_TEXTS = 100_000
 
 # ── Logging ──────────────────────────────────────────────────────────
 logging.basicConfig(
@@ -43,167 +73,436 @@ def init_supabase() -> Client:
     return client
 
 
+@lru_cache(maxsize=4096)
+def _parse_iso(raw: str) -> datetime:
+    """Parse an ISO-8601 string; cached since bulk inserts share timestamps.
+
+    fromisoformat accepts Supabase's fixed format (including a trailing
+    "Z") natively since Python 3.11, so no pre-processing is needed.
+    """
+    return datetime.fromisoformat(raw)
+
+
 def parse_timestamp(raw: str | datetime) -> datetime:
     """Normalise a Supabase timestamp to an aware UTC datetime."""
     if isinstance(raw, datetime):
         if raw.tzinfo is None:
             return raw.replace(tzinfo=timezone.utc)
         return raw
-    return datetime.fromisoformat(raw.replace("Z", "+00:00"))
+    return _parse_iso(raw)
 
 
 def is_repetitive(text: str) -> bool:
-    """Return True if *text* is built from a short repeating pattern."""
+    """Return True if *text* is built from a short repeating pattern.
+
+    A string is a pattern repeated at least twice (plus an optional
+    partial trailing repeat) exactly when its minimal period is at most
+    half its length. The period falls out of the KMP failure function
+    in a single O(L) pass.
+    """
     s = text.strip().lower()
     length = len(s)
     if length == 0:
         return True
-    for pattern_len in range(1, length // 2 + 1):
-        pattern = s[:pattern_len]
-        full_repeats = length // pattern_len
-        if pattern * full_repeats == s[: pattern_len * full_repeats]:
-            remaining = s[pattern_len * full_repeats :]
-            if pattern.startswith(remaining):
-                return True
-    return False
-
-
-def delete_rows(sb: Client, ids: list[int]) -> int:
-    """Delete rows by id list; return count deleted."""
-    if not ids:
-        return 0
-    deleted = 0
-    for row_id in ids:
+    fail = [0] * length
+    k = 0
+    for i in range(1, length):
+        ch = s[i]
+        while k and s[k] != ch:
+            k = fail[k - 1]
+        if s[k] == ch:
+            k += 1
+        fail[i] = k
+    period = length - fail[-1]
+    return period <= length // 2
+
+
+def _repetitive_kernel(codes: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """is_repetitive over concatenated code points; ``ends`` marks each text's end."""
+    out = np.zeros(ends.size, dtype=np.bool_)
+    for k in range(ends.size):
+        start = ends[k - 1] if k > 0 else 0
+        length = ends[k] - start
+        if length == 0:
+            out[k] = True
+            continue
+        fail = np.zeros(length, dtype=np.int64)
+        j = 0
+        for i in range(1, length):
+            ch = codes[start + i]
+            while j > 0 and codes[start + j] != ch:
+                j = fail[j - 1]
+            if codes[start + j] == ch:
+                j += 1
+            fail[i] = j
+        out[k] = length - fail[length - 1] <= length // 2
+    return out
+
+
+@lru_cache(maxsize=1)
+def _repetitive_batch():
+    """Compile _repetitive_kernel on first use; None without Numba."""
+    try:
+        from numba import njit
+    except ImportError:  # no JIT — repetitive_mask falls back to is_repetitive
+        return None
+    return njit(cache=True)(_repetitive_kernel)
+
+
+def repetitive_mask(texts: list[str]) -> list[bool]:
+    """Return is_repetitive() for each of *texts* in one batched call.
+
+    From JIT_MIN_TEXTS texts up, and with Numba available, the texts are
+    packed into a single UTF-32 code point buffer and checked by a compiled
+    kernel; otherwise each text goes through is_repetitive.
+    """
+    kernel = _repetitive_batch() if len(texts) >= JIT_MIN_TEXTS else None
+    if kernel is None:
+        return [is_repetitive(t) for t in texts]
+    normalized = [t.strip().lower() for t in texts]
+    codes = np.frombuffer(
+        "".join(normalized).encode("utf-32-le", "surrogatepass"), dtype=np.uint32
+    )
+    ends = np.cumsum([len(t) for t in normalized], dtype=np.int64)
+    return kernel(codes, ends).tolist()
+
+
+def _shingles(text: str) -> set[str]:
+    """Split *text* into overlapping character k-grams of SHINGLE_SIZE."""
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return {text[i : i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def _minhash(text: str) -> MinHash:
+    """Build a MinHash signature over the shingles of *text*."""
+    mh = MinHash(num_perm=MINHASH_PERMUTATIONS)
+    mh.update_batch([sh.encode("utf-8") for sh in _shingles(text)])
+    return mh
+
+
+def is_similar(a: str, b: str) -> bool:
+    """Return True if *a* and *b* meet SIMILARITY_THRESHOLD."""
+    if fuzz is not None:
+        return fuzz.ratio(a, b, score_cutoff=SIMILARITY_THRESHOLD * 100) > 0
+    return SequenceMatcher(None, a, b, autojunk=True).ratio() >= SIMILARITY_THRESHOLD
+
+
+def lengths_compatible(len_a: int, len_b: int) -> bool:
+    """Return True if strings of these lengths can reach SIMILARITY_THRESHOLD.
+
+    The matched length is at most the shorter string, so the ratio is
+    bounded above by 2 * min / (len_a + len_b).
+    """
+    return 2 * min(len_a, len_b) >= SIMILARITY_THRESHOLD * (len_a + len_b)
+
+
+def _score_pairs(pairs: list[tuple[str, str]]) -> list[bool]:
+    """Run is_similar over a chunk of text pairs."""
+    if fuzz is not None:
+        return [is_similar(a, b) for a, b in pairs]
+
+    # SequenceMatcher indexes seq2 (b2j) once and keeps it across set_seq1
+    # calls; visit pairs grouped by their longer text so the index is reused.
+    sm = SequenceMatcher(None, autojunk=True)
+    verdicts = [False] * len(pairs)
+
+    def seq2(k: int) -> str:
+        a, b = pairs[k]
+        return a if len(a) > len(b) else b
+
+    for k in sorted(range(len(pairs)), key=seq2):
+        a, b = pairs[k]
+        if len(a) > len(b):
+            a, b = b, a
+        sm.set_seq2(b)
+        sm.set_seq1(a)
+        verdicts[k] = (
+            sm.real_quick_ratio() >= SIMILARITY_THRESHOLD
+            and sm.quick_ratio() >= SIMILARITY_THRESHOLD
+            and sm.ratio() >= SIMILARITY_THRESHOLD
+        )
+    return verdicts
+
+
+def score_candidates(pairs: list[tuple[str, str]]) -> list[bool]:
+    """Return is_similar verdicts for *pairs*, in order.
+
+    RapidFuzz scores a pair in under a microsecond, less than it costs to
+    pickle it to another process, so it always runs serially. Only the
+    GIL-bound difflib fallback splits large candidate sets into one chunk
+    per CPU and scores them in worker processes.
+    """
+    workers = os.cpu_count() or 1
+    if fuzz is not None or workers == 1 or len(pairs) < PARALLEL_MIN_PAIRS:
+        return _score_pairs(pairs)
+    size = -(-len(pairs) // workers)
+    chunks = [pairs[i : i + size] for i in range(0, len(pairs), size)]
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        return [verdict for chunk in ex.map(_score_pairs, chunks) for verdict in chunk]
+
+
+def _chunks(ids: list[str]):
+    """Yield successive BATCH_SIZE slices of *ids*."""
+    for i in range(0, len(ids), BATCH_SIZE):
+        yield ids[i : i + BATCH_SIZE]
+
+
+def delete_rows(sb: Client, ids: list[str]) -> list[str]:
+    """Delete rows by id list in batches; return the ids deleted."""
+    deleted: list[str] = []
+    for chunk in _chunks(ids):
         try:
-            sb.table("reports").delete().eq("id", row_id).execute()
-            deleted += 1
+            sb.table("reports").delete().in_("id", chunk).execute()
+            deleted.extend(chunk)
         except Exception as exc:
-            log.error("Delete id=%s failed: %s", row_id, exc)
+            log.error("Delete batch of %d ids failed: %s", len(chunk), exc)
     return deleted
 
 
-def unverify_rows(sb: Client, ids: list[int]) -> int:
-    """Set is_verified=false for given ids; return count updated."""
+def unverify_rows(sb: Client, ids: list[str]) -> int:
+    """Set is_verified=false for given ids in batches; return count updated."""
     if not ids:
         return 0
     updated = 0
-    for row_id in ids:
+    for chunk in _chunks(ids):
         try:
-            sb.table("reports").update({"is_verified": False}).eq("id", row_id).execute()
-            updated += 1
+            sb.table("reports").update({"is_verified": False}).in_("id", chunk).execute()
+            updated += len(chunk)
         except Exception as exc:
-            log.error("Unverify id=%s failed: %s", row_id, exc)
+            log.error("Unverify batch of %d ids failed: %s", len(chunk), exc)
     return updated
 
 
-# ── Policy modules ───────────────────────────────────────────────────
+class ReportScan(NamedTuple):
+    """Per-policy work lists gathered in one pass over the reports."""
 
-def enforce_anti_flood(sb: Client, reports: list) -> int:
-    """Delete duplicate reports from the same reporter within a 10-min window.
+    by_reporter: dict[str, list[tuple[str, datetime]]]
+    low_quality: list[str]
+    empty_other: list[str]
+    descriptions: list[tuple[str, str, str, int]]
+
+
+def scan_reports(reports: list) -> ReportScan:
+    """Walk *reports* once, routing each row into every policy's work list.
 
-    Keeps the earliest report per window; removes the rest.
+    Each row's description is stripped, lower-cased and measured once,
+    and its timestamp parsed once, instead of once per policy.
     """
-    by_reporter: dict[str, list[tuple[int, datetime]]] = defaultdict(list)
+    scan = ReportScan(defaultdict(list), [], [], [])
+    repetition_checks: list[tuple[str, str]] = []
 
     for r in reports:
+        row_id = r["id"]
         rid = r.get("reporter_id")
-        if rid is None:
-            continue
-        by_reporter[rid].append((r["id"], parse_timestamp(r["created_at"])))
+        desc = (r.get("description") or "").strip().lower()
+        length = len(desc)
 
-    to_delete: list[int] = []
+        if rid is not None:
+            scan.by_reporter[rid].append((row_id, parse_timestamp(r["created_at"])))
+
+        if r.get("is_verified", False):
+            if length < MIN_DESCRIPTION_LENGTH:
+                scan.low_quality.append(row_id)
+            else:
+                repetition_checks.append((row_id, desc))
+
+        if length:
+            scan.descriptions.append((row_id, rid, desc, length))
+        elif r.get("issue_key") == "other":
+            scan.empty_other.append(row_id)
+
+    verdicts = repetitive_mask([desc for _, desc in repetition_checks])
+    scan.low_quality.extend(
+        row_id for (row_id, _), repetitive in zip(repetition_checks, verdicts) if repetitive
+    )
+    return scan
+
+
+def call_policy_rpc(sb: Client, name: str, params: dict) -> list[str] | None:
+    """Run a server-side policy function; return the ids it deleted.
+
+    Returns None when the function is not deployed or the call fails, so
+    the caller can fall back to the client-side policy.
+    """
+    try:
+        response = sb.rpc(name, params).execute()
+    except Exception as exc:
+        log.warning("RPC %s unavailable, using client-side policy: %s", name, exc)
+        return None
+    return list(response.data or [])
+
+
+# ── Policy modules ───────────────────────────────────────────────────
+
+def enforce_anti_flood(sb: Client, by_reporter: dict[str, list[tuple[str, datetime]]]) -> list[str]:
+    """Delete duplicate reports from the same reporter within a 10-min window.
+
+    Keeps the earliest report per window; removes the rest. Each
+    reporter's entries must be in ascending time order, which holds
+    because fetch_reports returns them oldest-first. Returns the ids
+    deleted.
+    """
+    to_delete: list[str] = []
+    window = timedelta(minutes=FLOOD_WINDOW_MINUTES)
 
     for rid, entries in by_reporter.items():
-        entries.sort(key=lambda x: x[1])
         _, anchor_ts = entries[0]
 
         for row_id, ts in entries[1:]:
-            if (ts - anchor_ts) <= timedelta(minutes=FLOOD_WINDOW_MINUTES):
+            if (ts - anchor_ts) <= window:
                 to_delete.append(row_id)
             else:
                 anchor_ts = ts
 
-    count = delete_rows(sb, to_delete)
-    log.info("Anti-Flood: deleted %d flood reports", count)
-    return count
-
-
-def enforce_quality_gate(sb: Client, reports: list) -> int:
-    """Unverify reports with descriptions < 15 chars or repetitive gibberish."""
-    to_unverify: list[int] = []
-
-    for r in reports:
-        if not r.get("is_verified", False):
-            continue
+    deleted = delete_rows(sb, to_delete)
+    log.info("Anti-Flood: deleted %d flood reports", len(deleted))
+    return deleted
 
-        desc = (r.get("description") or "").strip()
-        row_id = r["id"]
 
-        if len(desc) < MIN_DESCRIPTION_LENGTH or is_repetitive(desc):
-            to_unverify.append(row_id)
+def enforce_quality_gate(sb: Client, to_unverify: list[str]) -> int:
+    """Unverify reports with descriptions < 15 chars or repetitive gibberish.
 
+    *to_unverify* is the ``low_quality`` list built by scan_reports.
+    """
     count = unverify_rows(sb, to_unverify)
     log.info("Quality-Gate: flagged %d low-quality reports", count)
     return count
 
 
-def detect_duplicates(sb: Client, reports: list) -> int:
-    """Flag near-identical descriptions from different reporters as bot activity."""
-    flagged: set[int] = set()
-    items = [
-        (r["id"], r.get("reporter_id"), (r.get("description") or "").strip().lower())
-        for r in reports
-        if (r.get("description") or "").strip()
-    ]
+def detect_duplicates(sb: Client, descriptions: list[tuple[str, str, str, int]]) -> int:
+    """Flag near-identical descriptions from different reporters as bot activity.
 
-    for i in range(len(items)):
-        id_a, reporter_a, desc_a = items[i]
-        if id_a in flagged:
+    *descriptions* holds ``(id, reporter_id, text, len)`` for every
+    non-empty description, as built by scan_reports.
+    """
+    flagged: set[str] = set()
+    items = sorted(descriptions, key=lambda item: item[3])
+
+    # Identical descriptions from different reporters need no scoring
+    exact: dict[str, list[tuple[str, str]]] = defaultdict(list)
+    for row_id, reporter, desc, _ in items:
+        exact[desc].append((row_id, reporter))
+    for bucket in exact.values():
+        reporters = {reporter for _, reporter in bucket}
+        if len(reporters) > 1:
+            flagged.update(row_id for row_id, _ in bucket)
+            log.warning(
+                "Duplicate-Detect: identical text from %d reporters (ids %s)",
+                len(reporters), ", ".join(row_id for row_id, _ in bucket),
+            )
+
+    # On large batches, LSH buckets narrow the search to likely-similar
+    # pairs (trading some recall, see LSH_MIN_ITEMS); the scorer confirms
+    lsh = None
+    signatures: list[MinHash] = []
+    if len(items) >= LSH_MIN_ITEMS:
+        lsh = MinHashLSH(threshold=LSH_THRESHOLD, num_perm=MINHASH_PERMUTATIONS)
+        for idx, (_, _, desc, _) in enumerate(items):
+            mh = _minhash(desc)
+            lsh.insert(idx, mh)
+            signatures.append(mh)
+
+    # Items are sorted by length, so length-compatible partners of item i
+    # form a contiguous window (i, hi]; hi only ever moves forward.
+    candidates: list[tuple[int, int]] = []
+    hi = 0
+    for i, (_, reporter_a, desc_a, len_a) in enumerate(items):
+        hi = max(hi, i)
+        while hi + 1 < len(items) and lengths_compatible(len_a, items[hi + 1][3]):
+            hi += 1
+        if hi == i:
             continue
-        for j in range(i + 1, len(items)):
-            id_b, reporter_b, desc_b = items[j]
-            if reporter_a == reporter_b:
+        if lsh is None:
+            partners = range(i + 1, hi + 1)
+        else:
+            partners = (j for j in sorted(lsh.query(signatures[i])) if i < j <= hi)
+        for j in partners:
+            _, reporter_b, desc_b, _ = items[j]
+            if reporter_a == reporter_b or desc_a == desc_b:
                 continue
-            if SequenceMatcher(None, desc_a, desc_b).ratio() >= SIMILARITY_THRESHOLD:
-                flagged.add(id_a)
-                flagged.add(id_b)
-                log.warning(
-                    "Duplicate-Detect: reporters %s & %s (ids %d, %d)",
-                    reporter_a, reporter_b, id_a, id_b,
-                )
+            candidates.append((i, j))
+
+    verdicts = score_candidates([(items[i][2], items[j][2]) for i, j in candidates])
+    for (i, j), similar in zip(candidates, verdicts):
+        if not similar:
+            continue
+        id_a, reporter_a, _, _ = items[i]
+        id_b, reporter_b, _, _ = items[j]
+        flagged.add(id_a)
+        flagged.add(id_b)
+        log.warning(
+            "Duplicate-Detect: reporters %s & %s (ids %s, %s)",
+            reporter_a, reporter_b, id_a, id_b,
+        )
 
     count = unverify_rows(sb, list(flagged))
     log.info("Duplicate-Detect: flagged %d suspected bot reports", count)
     return count
 
 
-def auto_clean(sb: Client, reports: list) -> int:
-    """Remove issue_key='other' entries with empty descriptions."""
-    to_delete: list[int] = []
+def auto_clean(sb: Client, to_delete: list[str]) -> list[str]:
+    """Remove issue_key='other' entries with empty descriptions.
 
-    for r in reports:
-        if r.get("issue_key") != "other":
-            continue
-        desc = (r.get("description") or "").strip()
-        if not desc:
-            to_delete.append(r["id"])
-
-    count = delete_rows(sb, to_delete)
-    log.info("Auto-Cleaner: removed %d empty 'other' reports", count)
-    return count
+    *to_delete* is the ``empty_other`` list built by scan_reports.
+    Returns the ids deleted.
+    """
+    deleted = delete_rows(sb, to_delete)
+    log.info("Auto-Cleaner: removed %d empty 'other' reports", len(deleted))
+    return deleted
 
 
 # ── Entry point ──────────────────────────────────────────────────────
 
+def run_server_policies(sb: Client) -> tuple[list[str] | None, list[str] | None]:
+    """Run Anti-Flood and Auto-Cleaner inside Postgres.
+
+    Call before fetch_reports so deleted rows are never transferred.
+    Returns the ids each deleted, or None for a policy that must run
+    client-side instead.
+    """
+    flood_ids = call_policy_rpc(
+        sb, "guard_anti_flood",
+        {"window_minutes": FLOOD_WINDOW_MINUTES, "lookback_days": LOOKBACK_DAYS},
+    )
+    if flood_ids is not None:
+        log.info("Anti-Flood: deleted %d flood reports (server-side)", len(flood_ids))
+    clean_ids = call_policy_rpc(sb, "guard_auto_clean", {"lookback_days": LOOKBACK_DAYS})
+    if clean_ids is not None:
+        log.info("Auto-Cleaner: removed %d empty 'other' reports (server-side)", len(clean_ids))
+    return flood_ids, clean_ids
+
+
+def enforce_policies(
+    sb: Client,
+    reports: list,
+    flood_ids: list[str] | None,
+    clean_ids: list[str] | None,
+) -> set[str]:
+    """Run the client-side policies over *reports*; return every deleted id.
+
+    *flood_ids* / *clean_ids* come from run_server_policies; a None
+    entry runs that policy here instead.
+    """
+    scan = scan_reports(reports)
+    if flood_ids is None:
+        flood_ids = enforce_anti_flood(sb, scan.by_reporter)
+    enforce_quality_gate(sb, scan.low_quality)
+    detect_duplicates(sb, scan.descriptions)
+    if clean_ids is None:
+        clean_ids = auto_clean(sb, scan.empty_other)
+    return set(flood_ids) | set(clean_ids)
+
+
 def run() -> None:
     """Single-pass enforcement run."""
     log.info("── Policy Enforcer: run start ──")
 
     sb = init_supabase()
+    flood_ids, clean_ids = run_server_policies(sb)
 
     try:
-        response = sb.table("reports").select("*").order("created_at", desc=True).execute()
-        reports = response.data or []
+        reports = fetch_reports(sb)
     except Exception as exc:
         log.error("Failed to fetch reports: %s", exc)
         sys.exit(1)
@@ -214,10 +513,7 @@ def run() -> None:
         log.info("── run end (nothing to process) ──")
         return
 
-    enforce_anti_flood(sb, reports)
-    enforce_quality_gate(sb, reports)
-    detect_duplicates(sb, reports)
-    auto_clean(sb, reports)
+    enforce_policies(sb, reports, flood_ids, clean_ids)
 
     log.info("── Policy Enforcer: run complete ──")
 
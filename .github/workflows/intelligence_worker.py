@@ -5,11 +5,18 @@ Processes hotel safety reports with anomaly detection, risk scoring, and automat
 """
 
 import os
-from datetime import datetime, timedelta
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import NamedTuple
 import math
+import time
+
+import numpy as np
+import pandas as pd
 from supabase import create_client, Client
 
+from report_source import fetch_reports
+
 # Configuration - read from environment variables
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
@@ -31,188 +38,223 @@ def init_supabase() -> Client:
     return create_client(SUPABASE_URL, SUPABASE_KEY)
 
 
-def calculate_time_decay(report_time: datetime) -> float:
+class ReportColumns(NamedTuple):
+    """Report fields as parallel NumPy arrays (one entry per report)."""
+
+    ids: np.ndarray              # report ids
+    reporter_codes: np.ndarray   # int64 factorized reporter_id, -1 when missing
+    hotel_codes: np.ndarray      # int64 index into hotels, -1 when missing
+    hotels: np.ndarray           # distinct hotel_id values
+    severity_points: np.ndarray  # int8 base score, 0 when not scored
+    ts_ns: np.ndarray            # int64 epoch nanoseconds, NAT_NS when missing
+
+
+NAT_NS = np.iinfo(np.int64).min
+UTC_SUFFIX = '+00:00'
+
+
+def parse_epoch_ns(raw: list) -> np.ndarray:
     """
-    Calculate time decay factor using exponential decay with 12-hour half-life.
+    Convert created_at strings to int64 epoch nanoseconds.
+
+    Supabase returns timestamptz as 'YYYY-MM-DDTHH:MM:SS[.ffffff]+00:00'.
+    When every value has that UTC suffix it is sliced off and NumPy's
+    native ISO parser handles the rest; anything else goes through pandas.
 
     Args:
-        report_time: Timestamp of the report
+        raw: created_at values
 
     Returns:
-        Decay factor (0.0 to 1.0)
+        int64 array, NAT_NS where the timestamp is missing
     """
-    now = datetime.utcnow()
-    if report_time.tzinfo:
-        from datetime import timezone
-        now = datetime.now(timezone.utc)
-
-    hours_elapsed = (now - report_time).total_seconds() / 3600
-    decay_factor = math.pow(0.5, hours_elapsed / DECAY_HALF_LIFE_HOURS)
-    return decay_factor
+    if all(isinstance(value, str) and value.endswith(UTC_SUFFIX) for value in raw):
+        naive = [value[:-len(UTC_SUFFIX)] for value in raw]
+        return np.array(naive, dtype='datetime64[ns]').view(np.int64)
+    timestamps = pd.to_datetime(raw, utc=True, format='ISO8601', cache=True)
+    return timestamps.as_unit('ns').asi8
 
 
-def detect_anomalies(reports: list) -> set:
+def build_report_columns(reports: list) -> ReportColumns:
     """
-    Detect anomalous reports from same reporter within 60 seconds.
+    Split report records into parallel columnar arrays.
 
     Args:
         reports: List of report records
 
     Returns:
-        Set of report IDs to exclude as anomalies
+        ReportColumns with one entry per report
     """
-    reporter_timeline = defaultdict(list)
-    anomalies = set()
+    ids = np.asarray([r['id'] for r in reports], dtype=object)
+    reporter_codes, _ = pd.factorize(np.array([r.get('reporter_id') for r in reports], dtype=object))
+    hotel_codes, hotels = pd.factorize(np.array([r.get('hotel_id') for r in reports], dtype=object))
 
-    # Group reports by reporter_id with timestamps
-    for report in reports:
-        reporter_id = report.get('reporter_id')
-        report_id = report.get('id')
-        created_at = report.get('created_at')
+    severity = np.array([(r.get('severity') or '').upper() for r in reports], dtype=str)
+    severity_points = np.where(
+        severity == 'CRITICAL', CRITICAL_POINTS,
+        np.where(severity == 'WARNING', WARNING_POINTS, 0)
+    ).astype(np.int8)
 
-        if not all([reporter_id, report_id, created_at]):
-            continue
+    ts_ns = parse_epoch_ns([r.get('created_at') for r in reports])
 
-        # Parse timestamp
-        if isinstance(created_at, str):
-            timestamp = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-        else:
-            timestamp = created_at
+    return ReportColumns(
+        ids=ids,
+        reporter_codes=reporter_codes.astype(np.int64),
+        hotel_codes=hotel_codes.astype(np.int64),
+        hotels=np.asarray(hotels, dtype=object),
+        severity_points=severity_points,
+        ts_ns=ts_ns,
+    )
 
-        reporter_timeline[reporter_id].append((report_id, timestamp))
 
-    # Check for reports within 60-second window
-    for reporter_id, timeline in reporter_timeline.items():
-        timeline.sort(key=lambda x: x[1])
+def detect_anomalies(cols: ReportColumns) -> np.ndarray:
+    """
+    Detect anomalous reports from same reporter within 60 seconds.
 
-        for i in range(len(timeline) - 1):
-            current_id, current_time = timeline[i]
-            next_id, next_time = timeline[i + 1]
+    Args:
+        cols: Columnar reports from build_report_columns
 
-            time_diff = (next_time - current_time).total_seconds()
+    Returns:
+        Boolean mask over cols, True for reports to exclude as anomalies
+    """
+    rows = np.flatnonzero((cols.reporter_codes >= 0) & (cols.ts_ns != NAT_NS))
 
-            if time_diff <= ANOMALY_WINDOW_SECONDS:
-                # Flag the later report as anomaly
-                anomalies.add(next_id)
+    # Stable sort by (reporter, time); flag a report when the previous one
+    # from the same reporter is at most the window earlier
+    order = rows[np.lexsort((cols.ts_ns[rows], cols.reporter_codes[rows]))]
+    reporters = cols.reporter_codes[order]
+    ts_ns = cols.ts_ns[order]
+    same_reporter = reporters[1:] == reporters[:-1]
+    within_window = np.diff(ts_ns) <= ANOMALY_WINDOW_SECONDS * 1_000_000_000
 
-    return anomalies
+    anomalous = np.zeros(cols.ids.size, dtype=np.bool_)
+    anomalous[order[1:][same_reporter & within_window]] = True
+    return anomalous
 
 
-def calculate_hotel_risk_scores(reports: list, anomalies: set) -> dict:
+def calculate_hotel_risk_scores(cols: ReportColumns, anomalous: np.ndarray) -> dict:
     """
     Calculate risk scores for each hotel with time decay.
 
     Args:
-        reports: List of report records
-        anomalies: Set of anomalous report IDs to exclude
+        cols: Columnar reports from build_report_columns
+        anomalous: Boolean mask from detect_anomalies
 
     Returns:
         Dictionary mapping hotel_id to risk score
     """
-    hotel_scores = defaultdict(float)
-    hotel_report_counts = defaultdict(int)
+    keep = (
+        ~anomalous
+        & (cols.hotel_codes >= 0)
+        & (cols.severity_points > 0)
+        & (cols.ts_ns != NAT_NS)
+    )
+    hotel_codes = cols.hotel_codes[keep]
 
-    for report in reports:
-        report_id = report.get('id')
-        hotel_id = report.get('hotel_id')
-        severity = report.get('severity', '').upper()
-        created_at = report.get('created_at')
+    # Exponential decay with 12-hour half-life: 0.5 ** (h / 12) == exp(k * seconds)
+    decay_rate = math.log(0.5) / (DECAY_HALF_LIFE_HOURS * 3600)
+    age_seconds = (time.time_ns() - cols.ts_ns[keep]) / 1e9
+    weighted = cols.severity_points[keep] * np.exp(decay_rate * age_seconds)
 
-        # Skip anomalies
-        if report_id in anomalies:
-            continue
+    totals = np.bincount(hotel_codes, weights=weighted, minlength=len(cols.hotels))
+    scored = np.bincount(hotel_codes, minlength=len(cols.hotels)) > 0
+    return {cols.hotels[code]: float(totals[code]) for code in np.flatnonzero(scored)}
 
-        if not all([hotel_id, severity, created_at]):
-            continue
-
-        # Parse timestamp
-        if isinstance(created_at, str):
-            timestamp = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-        else:
-            timestamp = created_at
-
-        # Calculate base score
-        if severity == 'CRITICAL':
-            base_score = CRITICAL_POINTS
-        elif severity == 'WARNING':
-            base_score = WARNING_POINTS
-        else:
-            continue
 
-        # Apply time decay
-        decay_factor = calculate_time_decay(timestamp)
-        weighted_score = base_score * decay_factor
+def fetch_hotel_statuses(supabase: Client) -> dict:
+    """
+    Fetch the current hotel_status rows.
 
-        hotel_scores[hotel_id] += weighted_score
-        hotel_report_counts[hotel_id] += 1
+    Args:
+        supabase: Supabase client
 
-    return dict(hotel_scores)
+    Returns:
+        Dictionary mapping hotel_id to its current status row
+    """
+    response = supabase.table('hotel_status').select('hotel_id,status,risk_score').execute()
+    return {row['hotel_id']: row for row in response.data or []}
 
 
-def update_hotel_statuses(supabase: Client, hotel_scores: dict) -> int:
+def update_hotel_statuses(supabase: Client, hotel_scores: dict, current_statuses: dict) -> int | None:
     """
     Update hotel_status table for hotels exceeding risk threshold.
 
     Args:
         supabase: Supabase client
         hotel_scores: Dictionary of hotel_id to risk scores
+        current_statuses: Existing hotel_status rows keyed by hotel_id;
+            hotels already at ALERT with the same score are not rewritten
 
     Returns:
-        Number of hotels updated to ALERT status
+        Number of hotel_status rows written, or None if the upsert failed
     """
-    alert_count = 0
+    updated_at = datetime.utcnow().isoformat()
+    rows = []
 
     for hotel_id, risk_score in hotel_scores.items():
-        if risk_score > RISK_THRESHOLD:
-            try:
-                supabase.table('hotel_status').upsert({
-                    'hotel_id': hotel_id,
-                    'status': 'ALERT',
-                    'risk_score': round(risk_score, 2),
-                    'updated_at': datetime.utcnow().isoformat()
-                }).execute()
-                alert_count += 1
-            except Exception as e:
-                print(f"[ERROR] Failed to update hotel {hotel_id}: {e}")
+        if risk_score <= RISK_THRESHOLD:
+            continue
+        risk_score = round(risk_score, 2)
+        current = current_statuses.get(hotel_id)
+        if (
+            current
+            and current.get('status') == 'ALERT'
+            and current.get('risk_score') is not None
+            and float(current['risk_score']) == risk_score
+        ):
+            continue
+        rows.append({
+            'hotel_id': hotel_id,
+            'status': 'ALERT',
+            'risk_score': risk_score,
+            'updated_at': updated_at
+        })
 
-    return alert_count
+    if not rows:
+        return 0
 
+    # Single batched upsert — PostgREST accepts an array of rows
+    try:
+        supabase.table('hotel_status').upsert(rows).execute()
+    except Exception as e:
+        print(f"[ERROR] Failed to update {len(rows)} hotels: {e}")
+        return None
 
-def run_intelligence_worker():
-    """Main execution logic for intelligence worker."""
-    print("=" * 60)
-    print("StayLive Intelligence Worker - Starting Analysis")
-    print("=" * 60)
+    return len(rows)
 
-    # Initialize client
-    supabase = init_supabase()
 
-    # Fetch recent reports
-    print("\n[1/5] Fetching reports from database...")
-    try:
-        response = supabase.table('reports').select('*').order('created_at', desc=True).execute()
-        reports = response.data
-        print(f"      → Retrieved {len(reports)} reports")
-    except Exception as e:
-        print(f"[ERROR] Failed to fetch reports: {e}")
-        return
+def analyze_reports(supabase: Client, reports: list, current_statuses: dict):
+    """
+    Score already-fetched reports and write hotel alerts (steps 2-5).
 
+    Args:
+        supabase: Supabase client
+        reports: Report records, e.g. from fetch_reports
+        current_statuses: Existing hotel_status rows keyed by hotel_id
+    """
     # Anomaly detection
     print("\n[2/5] Running anomaly detection...")
-    anomalies = detect_anomalies(reports)
-    print(f"      → Detected {len(anomalies)} anomalous reports")
-    if anomalies:
-        print(f"      → Excluded report IDs: {sorted(anomalies)}")
+    cols = build_report_columns(reports)
+    anomalous = detect_anomalies(cols)
+    anomaly_ids = np.sort(cols.ids[anomalous]).tolist()
+    print(f"      → Detected {len(anomaly_ids)} anomalous reports")
+    if anomaly_ids:
+        print(f"      → Excluded report IDs: {anomaly_ids}")
 
     # Calculate risk scores
     print("\n[3/5] Calculating hotel risk scores...")
-    hotel_scores = calculate_hotel_risk_scores(reports, anomalies)
+    hotel_scores = calculate_hotel_risk_scores(cols, anomalous)
     print(f"      → Analyzed {len(hotel_scores)} unique hotels")
 
     # Update statuses
     print("\n[4/5] Updating hotel statuses...")
-    alert_count = update_hotel_statuses(supabase, hotel_scores)
-    print(f"      → Updated {alert_count} hotels to ALERT status")
+    updated_count = update_hotel_statuses(supabase, hotel_scores, current_statuses)
+    alert_count = sum(1 for score in hotel_scores.values() if score > RISK_THRESHOLD)
+    if updated_count is None:
+        print(f"      → [ERROR] Failed to update hotel statuses "
+              f"({alert_count} hotels at ALERT level left unwritten)")
+    else:
+        print(f"      → Updated {updated_count} hotels to ALERT status "
+              f"({alert_count - updated_count} already current)")
 
     # Structured logging
     print("\n[5/5] Risk Score Summary:")
@@ -232,5 +274,37 @@ def run_intelligence_worker():
     print("=" * 60)
 
 
+def run_intelligence_worker():
+    """Main execution logic for intelligence worker."""
+    print("=" * 60)
+    print("StayLive Intelligence Worker - Starting Analysis")
+    print("=" * 60)
+
+    # Initialize client
+    supabase = init_supabase()
+
+    # Fetch reports and current hotel statuses concurrently
+    print("\n[1/5] Fetching reports from database...")
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        reports_future = executor.submit(fetch_reports, supabase)
+        statuses_future = executor.submit(fetch_hotel_statuses, supabase)
+
+        try:
+            reports = reports_future.result()
+            print(f"      → Retrieved {len(reports)} reports")
+        except Exception as e:
+            print(f"[ERROR] Failed to fetch reports: {e}")
+            return
+
+        try:
+            current_statuses = statuses_future.result()
+            print(f"      → Retrieved {len(current_statuses)} hotel statuses")
+        except Exception as e:
+            print(f"[WARN] Failed to fetch hotel statuses, writing all alerts: {e}")
+            current_statuses = {}
+
+    analyze_reports(supabase, reports, current_statuses)
+
+
 if __name__ == "__main__":
     run_intelligence_worker()
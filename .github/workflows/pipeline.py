@@ -0,0 +1,60 @@
+
+"""
+StayLive Pipeline
+Scheduled entry point: fetches reports once, runs the Policy Enforcer over
+them, then feeds the surviving rows to the Intelligence Worker.
+"""
+
+import sys
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import guard
+import intelligence_worker
+from report_source import fetch_reports
+
+log = logging.getLogger("pipeline")
+
+
+def run() -> None:
+    """Single fetch → policy enforcement → risk scoring."""
+    log.info("── Pipeline: run start ──")
+
+    sb = guard.init_supabase()
+
+    # hotel_status is only needed by the scoring phase; fetch it in the
+    # background during the server-side policies and the reports query.
+    # The pool is shut down before enforcement so no thread is alive when
+    # score_candidates forks its worker processes.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        statuses_future = executor.submit(intelligence_worker.fetch_hotel_statuses, sb)
+
+        flood_ids, clean_ids = guard.run_server_policies(sb)
+
+        try:
+            reports = fetch_reports(sb)
+        except Exception as exc:
+            log.error("Failed to fetch reports: %s", exc)
+            sys.exit(1)
+
+        try:
+            current_statuses = statuses_future.result()
+        except Exception as exc:
+            log.warning("Failed to fetch hotel statuses, writing all alerts: %s", exc)
+            current_statuses = {}
+
+    log.info("Fetched %d reports", len(reports))
+
+    deleted = guard.enforce_policies(sb, reports, flood_ids, clean_ids) if reports else set()
+
+    # Rows removed by the enforcer must not contribute to risk scores
+    remaining = [r for r in reports if r["id"] not in deleted]
+    log.info("Scoring %d reports (%d removed by policies)", len(remaining), len(deleted))
+
+    intelligence_worker.analyze_reports(sb, remaining, current_statuses)
+
+    log.info("── Pipeline: run complete ──")
+
+
+if __name__ == "__main__":
+    run()
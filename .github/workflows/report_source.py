@@ -0,0 +1,45 @@
+
+"""
+StayLive Report Source
+Shared reports query for the Policy Enforcer and the Intelligence Worker.
+"""
+
+from datetime import datetime, timezone, timedelta
+
+from supabase import Client
+
+# ── Configuration ────────────────────────────────────────────────────
+LOOKBACK_DAYS = 7
+PAGE_SIZE = 1000  # rows per request; must not exceed the project's PostgREST max-rows (1000 by default)
+
+# Union of the columns read by every guard policy and the worker
+REPORT_COLUMNS = (
+    "id,reporter_id,hotel_id,severity,description,is_verified,issue_key,created_at"
+)
+
+
+def fetch_reports(sb: Client) -> list:
+    """Fetch reports from the last LOOKBACK_DAYS, oldest first.
+
+    PostgREST truncates every response at its max-rows cap, so the window
+    is read in PAGE_SIZE pages until a short page comes back. Ascending
+    order (ties broken by id) is relied on by the anti-flood sweep, and
+    keeps offsets stable while reports are inserted mid-read. Errors
+    propagate to the caller.
+    """
+    since = datetime.now(timezone.utc) - timedelta(days=LOOKBACK_DAYS)
+    reports: list = []
+    while True:
+        response = (
+            sb.table("reports")
+            .select(REPORT_COLUMNS)
+            .gte("created_at", since.isoformat())
+            .order("created_at")
+            .order("id")
+            .range(len(reports), len(reports) + PAGE_SIZE - 1)
+            .execute()
+        )
+        page = response.data or []
+        reports.extend(page)
+        if len(page) < PAGE_SIZE:
+            return reports
@@ -0,0 +1,63 @@
+-- Server-side versions of the guard.py Anti-Flood and Auto-Cleaner policies.
+-- Both delete in a single statement and return the removed report ids, so
+-- the scheduled enforcer never has to pull these rows over the wire.
+-- guard.py falls back to its client-side implementation if they are absent.
+
+-- Anti-Flood: per reporter, keep the earliest report of each window and
+-- delete any report within window_minutes of that window's anchor. The
+-- anchor only moves when a report falls outside the current window, which
+-- needs a sequential walk: one ordered scan, compared row by row.
+create or replace function public.guard_anti_flood(
+  window_minutes integer default 10,
+  lookback_days integer default 7
+)
+returns setof uuid
+language plpgsql
+as $$
+declare
+  flood_window constant interval := make_interval(mins => window_minutes);
+  r record;
+  current_reporter public.reports.reporter_id%type;
+  anchor timestamptz;
+  flood_ids uuid[] := '{}';
+begin
+  for r in
+    select id, reporter_id, created_at
+    from public.reports
+    where reporter_id is not null
+      and created_at >= now() - make_interval(days => lookback_days)
+    order by reporter_id, created_at, id
+  loop
+    if current_reporter is distinct from r.reporter_id then
+      current_reporter := r.reporter_id;
+      anchor := r.created_at;
+    elsif r.created_at - anchor <= flood_window then
+      flood_ids := flood_ids || r.id;
+    else
+      anchor := r.created_at;
+    end if;
+  end loop;
+
+  return query
+    delete from public.reports
+    where id = any(flood_ids)
+    returning id;
+end;
+$$;
+
+-- Auto-Cleaner: remove issue_key = 'other' reports with a blank description.
+create or replace function public.guard_auto_clean(
+  lookback_days integer default 7
+)
+returns setof uuid
+language sql
+as $$
+  delete from public.reports
+  where issue_key = 'other'
+    and coalesce(description, '') ~ '^\s*$'
+    and created_at >= now() - make_interval(days => lookback_days)
+  returning id;
+$$;
+
+revoke execute on function public.guard_anti_flood(integer, integer) from public, anon, authenticated;
+revoke execute on function public.guard_auto_clean(integer) from public, anon, authenticated;